@@ -2,54 +2,182 @@ from flask import Flask, request, jsonify
 import cv2
 import numpy as np
 from ultralytics import YOLO
-import tempfile
 import os
 from datetime import datetime
-import json
+import orjson
 import threading
+import functools
+import queue
 import time
+import atexit
+import torch
+from export_model import MAX_BATCH_SIZE
 
 app = Flask(__name__)
-model = YOLO('yolov8n.pt')
+
+def load_model():
+    # Prefer the TensorRT engine built by export_model.py when a GPU is present,
+    # then the ONNX export for CPU-only hosts, then the stock PyTorch weights
+    model_path = os.environ.get('YOLO_MODEL')
+    if model_path:
+        return YOLO(model_path)
+    
+    if torch.cuda.is_available() and os.path.exists('yolov8n.engine'):
+        return YOLO('yolov8n.engine', task='detect')
+    if not torch.cuda.is_available() and os.path.exists('yolov8n.onnx'):
+        return YOLO('yolov8n.onnx', task='detect')
+    return YOLO('yolov8n.pt')
+
+model = load_model()
+# Ultralytics predictors are not safe to share between threads; requests can
+# overlap on upload/decode/save but take turns on the forward pass
+model_lock = threading.Lock()
+class_names_arr = np.array([model.names[i] for i in range(len(model.names))])
+
+@functools.lru_cache(maxsize=1024)
+def text_size(label):
+    # Labels repeat heavily ("person: 0.87"), so glyph metrics are cached per string
+    return cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
 
 class ImageSaver:
-    def __init__(self, output_dir='./images'):
+    def __init__(self, output_dir='./images', annotator_count=None):
         self.output_dir = output_dir
         self.lock = threading.Lock()
         
+        # One annotator per request thread (gunicorn.conf.py THREADS) so JPEG encoding,
+        # which releases the GIL, keeps up with concurrent uploads
+        if annotator_count is None:
+            annotator_count = int(os.environ.get('THREADS', '8'))
+        
+        # Two-stage pipeline behind the request thread: annotate+encode, then disk write.
+        # The bounded annotate queue applies backpressure if drawing falls behind inference.
+        self.annotate_queue = queue.Queue(maxsize=annotator_count)
+        self.write_queue = queue.Queue(maxsize=annotator_count)
+        self.annotator_threads = [
+            threading.Thread(target=self._annotate_loop, daemon=True)
+            for _ in range(annotator_count)
+        ]
+        self.writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        
         os.makedirs(output_dir, exist_ok=True)
+        # Scanned once at startup, then only bumped by the writer thread; assumes this
+        # is the only process writing to output_dir (gunicorn.conf.py pins workers = 1)
+        self.total_saved = len([f for f in os.listdir(output_dir) if f.endswith('.jpg')])
+        for thread in self.annotator_threads:
+            thread.start()
+        self.writer_thread.start()
+    
+    def _annotate_loop(self):
+        while True:
+            filepath, image, detections = self.annotate_queue.get()
+            try:
+                self._draw_detections(image, detections)
+                success, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+                if success:
+                    self.write_queue.put((filepath, buffer.tobytes()))
+                else:
+                    print(f"Failed to encode image: {os.path.basename(filepath)}")
+            except Exception as e:
+                print(f"Failed to annotate image {os.path.basename(filepath)}: {e}")
+            finally:
+                self.annotate_queue.task_done()
+    
+    def _write_loop(self):
+        while True:
+            filepath, data = self.write_queue.get()
+            try:
+                with open(filepath, 'wb') as f:
+                    f.write(data)
+                self.total_saved += 1
+                print(f"Saved annotated image: {os.path.basename(filepath)}")
+            except OSError as e:
+                print(f"Failed to save image {os.path.basename(filepath)}: {e}")
+            finally:
+                self.write_queue.task_done()
+    
+    def close(self):
+        # Let queued images reach disk before the process exits; their paths
+        # have already been returned to clients
+        self.annotate_queue.join()
+        self.write_queue.join()
+    
+    def _draw_detections(self, image, detections):
+        height, width = image.shape[:2]
+        
+        for detection in detections:
+            x1, y1, x2, y2 = (int(v) for v in detection['bbox'])
+            confidence = detection['confidence']
+            class_name = detection['class']
+            
+            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            
+            label = f"{class_name}: {confidence:.2f}"
+            label_size = text_size(label)
+            
+            # Label background as a plain slice fill instead of a filled cv2.rectangle
+            top = max(y1 - label_size[1] - 10, 0)
+            right = min(x1 + label_size[0], width)
+            image[top:max(y1, 0), max(x1, 0):right] = (0, 255, 0)
+            
+            cv2.putText(image, label, (x1, y1 - 5), 
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
     
-    def save_annotated_image(self, image, camera_id, sequence, detections):
+    def save_annotated_image(self, image, camera_id, sequence, detections, copy=False):
+        # Returns the path the image will be written to once the pipeline drains.
+        # Annotation, encode and write failures happen later and are only logged,
+        # so the file may never appear at that path.
         with self.lock:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # microseconds to milliseconds
             filename = f"{camera_id}_{sequence:06d}_{timestamp}.jpg"
             filepath = os.path.join(self.output_dir, filename)
-            
-            annotated_image = image.copy()
-            
-            for detection in detections:
-                x1, y1, x2, y2 = detection['bbox']
-                confidence = detection['confidence']
-                class_name = detection['class']
-                
-                cv2.rectangle(annotated_image, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                
-                label = f"{class_name}: {confidence:.2f}"
-                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
-                cv2.rectangle(annotated_image, (int(x1), int(y1) - label_size[1] - 10), 
-                            (int(x1) + label_size[0], int(y1)), (0, 255, 0), -1)
-                cv2.putText(annotated_image, label, (int(x1), int(y1) - 5), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
-            
-            success = cv2.imwrite(filepath, annotated_image)
-            if success:
-                print(f"Saved annotated image: {filename}")
-                return filepath
-            else:
-                print(f"Failed to save image: {filename}")
-                return None
+        
+        # Annotators draw straight onto the decoded buffer unless the caller still needs it
+        annotated_image = image.copy() if copy else image
+        self.annotate_queue.put((filepath, annotated_image, detections))
+        return filepath
 
 image_saver = ImageSaver()
+# Runs on normal exit, Ctrl+C and gunicorn worker shutdown, while the daemon threads are still alive
+atexit.register(image_saver.close)
+
+def orjson_response(payload):
+    return app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype='application/json'
+    )
+
+def detect_batch(images):
+    # One forward pass per MAX_BATCH_SIZE images instead of one model() call per image;
+    # the TensorRT engine rejects batches larger than it was exported with
+    detections_per_image = []
+    results = []
+    for start in range(0, len(images), MAX_BATCH_SIZE):
+        with model_lock:
+            # verbose=False skips building and printing the per-image summary line
+            results.extend(model.predict(images[start:start + MAX_BATCH_SIZE], verbose=False))
+    
+    for result in results:
+        detections = []
+        boxes = result.boxes
+        if boxes is not None:
+            # Move each tensor off the device once rather than per box; the numpy
+            # values are serialized as-is by orjson_response
+            xyxy = boxes.xyxy.cpu().numpy()
+            confidences = boxes.conf.cpu().numpy()
+            class_names = class_names_arr[boxes.cls.cpu().numpy().astype(np.int32)]
+            timestamp = datetime.now().isoformat()
+            
+            for bbox, confidence, class_name in zip(xyxy, confidences, class_names):
+                detection = {
+                    'timestamp': timestamp,
+                    'class': class_name,
+                    'confidence': confidence,
+                    'bbox': bbox
+                }
+                detections.append(detection)
+        detections_per_image.append(detections)
+    
+    return detections_per_image
 
 @app.route('/upload', methods=['POST'])
 def upload_image():
@@ -61,46 +189,64 @@ def upload_image():
         camera_id = request.headers.get('Camera-ID', 'unknown')
         sequence = request.headers.get('Sequence', '0')
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            image_file.save(temp_file.name)
+        # Decode straight from the request body; no temp file round-trip
+        image_data = np.frombuffer(image_file.read(), np.uint8)
+        image = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
+        if image is None:
+            return jsonify({'error': 'Invalid image file'}), 400
+        
+        detections = detect_batch([image])[0]
+        
+        saved_path = image_saver.save_annotated_image(image, camera_id, int(sequence), detections)
+        
+        response = {
+            'camera_id': camera_id,
+            'sequence': sequence,
+            'detections': detections,
+            'detection_count': len(detections),
+            'saved_image': saved_path  # written asynchronously, see save_annotated_image
+        }
+        
+        return orjson_response(response)
             
-            image = cv2.imread(temp_file.name)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_image_batch():
+    try:
+        image_files = request.files.getlist('image')
+        if not image_files:
+            return jsonify({'error': 'No image files provided'}), 400
+        
+        camera_id = request.headers.get('Camera-ID', 'unknown')
+        # Sequence is that of the first image; the rest follow in upload order
+        first_sequence = int(request.headers.get('Sequence', '0'))
+        
+        images = []
+        for image_file in image_files:
+            image_data = np.frombuffer(image_file.read(), np.uint8)
+            image = cv2.imdecode(image_data, cv2.IMREAD_COLOR)
             if image is None:
-                os.unlink(temp_file.name)
-                return jsonify({'error': 'Invalid image file'}), 400
-            
-            detections = []
-            results = model(image)
-            
-            for result in results:
-                boxes = result.boxes
-                if boxes is not None:
-                    for box in boxes:
-                        x1, y1, x2, y2 = box.xyxy[0].tolist()
-                        confidence = float(box.conf[0])
-                        class_name = model.names[int(box.cls[0])]
-                        
-                        detection = {
-                            'timestamp': datetime.now().isoformat(),
-                            'class': class_name,
-                            'confidence': confidence,
-                            'bbox': [x1, y1, x2, y2]
-                        }
-                        detections.append(detection)
-            
-            saved_path = image_saver.save_annotated_image(image, camera_id, int(sequence), detections)
-            
-            os.unlink(temp_file.name)
+                return jsonify({'error': f'Invalid image file: {image_file.filename}'}), 400
+            images.append(image)
+        
+        detections_per_image = detect_batch(images)
+        
+        response = []
+        for offset, (image, detections) in enumerate(zip(images, detections_per_image)):
+            sequence = first_sequence + offset
+            saved_path = image_saver.save_annotated_image(image, camera_id, sequence, detections)
             
-            response = {
+            response.append({
                 'camera_id': camera_id,
-                'sequence': sequence,
+                'sequence': str(sequence),
                 'detections': detections,
                 'detection_count': len(detections),
-                'saved_image': saved_path
-            }
-            
-            return jsonify(response)
+                'saved_image': saved_path  # written asynchronously, see save_annotated_image
+            })
+        
+        return orjson_response(response)
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -111,14 +257,15 @@ def health_check():
 
 @app.route('/images/status', methods=['GET'])
 def images_status():
-    with image_saver.lock:
-        image_count = len([f for f in os.listdir(image_saver.output_dir) if f.endswith('.jpg')])
-        return jsonify({
-            'output_directory': image_saver.output_dir,
-            'total_images_saved': image_count,
-            'is_active': True
-        })
+    return jsonify({
+        'output_directory': image_saver.output_dir,
+        'total_images_saved': image_saver.total_saved,
+        'is_active': True
+    })
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development only; production runs under gunicorn (see gunicorn.conf.py).
+    # The debug reloader imports this module twice and would load the model twice.
+    debug = os.environ.get('FLASK_ENV') == 'development'
+    app.run(host='0.0.0.0', port=5000, debug=debug, threaded=True)
 
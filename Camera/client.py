@@ -1,5 +1,7 @@
 import requests
-import subprocess
+from requests.adapters import HTTPAdapter
+from picamera2 import Picamera2
+import io
 import time
 import os
 import sys
@@ -9,75 +11,90 @@ class PiCameraClient:
     def __init__(self, server_url='http://localhost:5000', camera_id='pi_zero_01'):
         self.server_url = server_url
         self.camera_id = camera_id
-        self.upload_endpoint = f"{server_url}/upload"
+        self.batch_upload_endpoint = f"{server_url}/upload/batch"
         self.health_endpoint = f"{server_url}/health"
         
+        # Reuse one keep-alive connection for every request instead of reconnecting per upload
+        self.session = requests.Session()
+        self.session.mount(server_url, HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers.update({'Connection': 'keep-alive'})
+        
     def check_server_health(self):
         try:
-            response = requests.get(self.health_endpoint, timeout=5)
+            response = self.session.get(self.health_endpoint, timeout=5)
             return response.status_code == 200
         except:
             return False
     
-    def capture_image(self, output_path='/tmp/image_capture.jpg'):
-        cmd = [
-            'libcamera-still',
-            '-o', output_path,
-            '--width', '640',
-            '--height', '480',
-            '--quality', '85',
-            '--timeout', '1'
-        ]
-        
+    def start_camera(self):
+        # Keep the sensor streaming so exposure/white balance stay converged between captures
+        self.camera = Picamera2()
+        config = self.camera.create_video_configuration(main={'size': (640, 480), 'format': 'RGB888'})
+        self.camera.configure(config)
+        self.camera.options['quality'] = 85
+        self.camera.start()
+    
+    def stop_camera(self):
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                return output_path
-            else:
-                print(f"Error capturing image: {result.stderr}")
-                return None
+            self.camera.stop()
+            self.camera.close()
+        except Exception as e:
+            print(f"Error stopping camera: {e}")
+    
+    def capture_image(self):
+        try:
+            buffer = io.BytesIO()
+            self.camera.capture_file(buffer, format='jpeg')
+            return buffer.getvalue()
         except Exception as e:
             print(f"Exception during image capture: {e}")
             return None
     
-    def upload_image(self, image_path, sequence_num):
-        if not os.path.exists(image_path):
-            print(f"Image file not found: {image_path}")
-            return None
-            
+    def upload_batch(self, images, first_sequence):
         headers = {
             'Camera-ID': self.camera_id,
-            'Sequence': str(sequence_num)
+            'Sequence': str(first_sequence)
         }
         
         try:
-            with open(image_path, 'rb') as image_file:
-                files = {'image': image_file}
-                response = requests.post(
-                    self.upload_endpoint,
-                    files=files,
-                    headers=headers,
-                    timeout=30
-                )
+            files = [
+                ('image', (f'capture_{first_sequence + offset}.jpg', image_data, 'image/jpeg'))
+                for offset, image_data in enumerate(images)
+            ]
+            response = self.session.post(
+                self.batch_upload_endpoint,
+                files=files,
+                headers=headers,
+                timeout=60
+            )
+            
+            if response.status_code == 200:
+                return response.json()
+            else:
+                print(f"Batch upload failed with status {response.status_code}: {response.text}")
+                return None
                 
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    print(f"Upload failed with status {response.status_code}: {response.text}")
-                    return None
-                    
         except Exception as e:
-            print(f"Exception during upload: {e}")
+            print(f"Exception during batch upload: {e}")
             return None
     
-    def cleanup_image_file(self, image_path):
-        try:
-            if os.path.exists(image_path):
-                os.remove(image_path)
-        except Exception as e:
-            print(f"Error cleaning up image file: {e}")
+    def upload_and_report(self, batch, first_sequence, timestamp):
+        last_sequence = first_sequence + len(batch) - 1
+        print(f"[{timestamp}] Uploading images #{first_sequence}-#{last_sequence}...")
+        
+        results = self.upload_batch(batch, first_sequence)
+        if results:
+            for result in results:
+                detection_count = result.get('detection_count', 0)
+                print(f"[{timestamp}] Image #{result['sequence']} processed: {detection_count} detections")
+                
+                if detection_count > 0:
+                    for detection in result.get('detections', []):
+                        print(f"  - {detection['class']} (confidence: {detection['confidence']:.2f})")
+        else:
+            print(f"[{timestamp}] Upload failed for images #{first_sequence}-#{last_sequence}")
     
-    def run_continuous_capture(self, fps=2):
+    def run_continuous_capture(self, fps=2, batch_size=8):
         sequence = 0
         capture_interval = 1.0 / fps  # 0.5 seconds for 2 fps
         
@@ -88,32 +105,35 @@ class PiCameraClient:
         print(f"Starting continuous image capture (Camera ID: {self.camera_id})")
         print(f"Capture rate: {fps} fps, Server: {self.server_url}")
         
+        self.start_camera()
+        
+        batch = []
+        # Sequence of batch[0], tracked explicitly so a flush stays correctly numbered
+        # even if capture stops between bumping sequence and appending a frame
+        batch_start = None
+        
         try:
             while True:
                 sequence += 1
                 timestamp = datetime.now().isoformat()
-                image_path = f'/tmp/image_capture_{sequence}.jpg'
                 
                 print(f"[{timestamp}] Capturing image #{sequence}...")
                 
-                captured_file = self.capture_image(image_path)
-                if captured_file:
-                    print(f"[{timestamp}] Uploading image #{sequence}...")
-                    
-                    result = self.upload_image(captured_file, sequence)
-                    if result:
-                        detection_count = result.get('detection_count', 0)
-                        print(f"[{timestamp}] Image #{sequence} processed: {detection_count} detections")
-                        
-                        if detection_count > 0:
-                            for detection in result.get('detections', []):
-                                print(f"  - {detection['class']} (confidence: {detection['confidence']:.2f})")
-                    else:
-                        print(f"[{timestamp}] Upload failed for image #{sequence}")
-                    
-                    self.cleanup_image_file(captured_file)
+                image_data = self.capture_image()
+                if image_data:
+                    if not batch:
+                        batch_start = sequence
+                    batch.append(image_data)
+                    # Send frames together so the server can run them in one batched forward pass
+                    if len(batch) >= batch_size:
+                        pending, batch = batch, []
+                        self.upload_and_report(pending, batch_start, timestamp)
                 else:
                     print(f"[{timestamp}] Failed to capture image #{sequence}")
+                    # The server numbers a batch consecutively, so flush before the gap
+                    if batch:
+                        pending, batch = batch, []
+                        self.upload_and_report(pending, batch_start, timestamp)
                 
                 time.sleep(capture_interval)
                 
@@ -121,6 +141,11 @@ class PiCameraClient:
             print("\nStopping capture...")
         except Exception as e:
             print(f"Error in continuous capture: {e}")
+        finally:
+            # Don't drop frames that were captured but not yet sent
+            if batch:
+                self.upload_and_report(batch, batch_start, datetime.now().isoformat())
+            self.stop_camera()
 
 def main():
     if len(sys.argv) > 1:
@@ -0,0 +1,36 @@
+from ultralytics import YOLO
+import torch
+import sys
+
+# Largest batch the exported engine accepts; api.detect_batch splits larger requests
+MAX_BATCH_SIZE = 16
+
+def main():
+    # Usage: python export_model.py [calibration.yaml]
+    # Passing a dataset yaml of representative frames builds an INT8 engine instead of FP16
+    calibration_data = sys.argv[1] if len(sys.argv) > 1 else None
+    
+    model = YOLO('yolov8n.pt')
+    
+    if not torch.cuda.is_available():
+        path = model.export(format='onnx', imgsz=640, dynamic=True)
+        print(f"No CUDA device found, exported ONNX model: {path}")
+        return
+    
+    export_args = {
+        'format': 'engine',
+        'imgsz': 640,
+        'dynamic': True,
+        'batch': MAX_BATCH_SIZE,
+        'workspace': 4,
+        'half': True
+    }
+    if calibration_data:
+        export_args['int8'] = True
+        export_args['data'] = calibration_data
+    
+    path = model.export(**export_args)
+    print(f"Exported TensorRT engine: {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+# Production server: gunicorn -c gunicorn.conf.py api:app
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# A single worker process: each worker would load its own copy of the model,
+# and ImageSaver.total_saved (served by /images/status) is an in-process counter
+# that is only correct when one process does all the writes. Scale with threads.
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', '8'))
+
+# Inference can take a while on CPU-only hosts
+timeout = 120